@@ -29,47 +29,67 @@ VERSION_INFO = {
     'version': VERSION,
 }
 
-DB_HOST = os.environ.get('DB_HOST')
-DB_RO_HOST = os.environ.get('DB_RO_HOST', DB_HOST)
-DB_RW_HOST = os.environ.get('DB_RW_HOST', DB_HOST)
-
-DB_USER = os.environ.get('DB_USER', 'location')
-DB_RO_USER = os.environ.get('DB_RO_USER', DB_USER)
-DB_RW_USER = os.environ.get('DB_RW_USER', DB_USER)
-DB_DDL_USER = os.environ.get('DB_DDL_USER', DB_USER)
-
-DB_PWD = os.environ.get('DB_PWD', 'location')
-DB_RO_PWD = os.environ.get('DB_RO_PWD', DB_PWD)
-DB_RW_PWD = os.environ.get('DB_RW_PWD', DB_PWD)
-DB_DDL_PWD = os.environ.get('DB_DDL_PWD', DB_PWD)
-
-DB_PORT = os.environ.get('DB_PORT', '3306')
-DB_NAME = os.environ.get('DB_NAME', 'location')
-
-DB_RW_URI = os.environ.get('DB_RW_URI')
-DB_RO_URI = os.environ.get('DB_RO_URI')
-DB_DDL_URI = os.environ.get('DB_DDL_URI')
-
-if not DB_RO_URI:
-    DB_RO_URI = ('mysql+pymysql://%s:%s@%s:%s/%s' % (
-        DB_RO_USER, DB_RO_PWD, DB_RO_HOST, DB_PORT, DB_NAME))
-
-if not DB_RW_URI:
-    DB_RW_URI = ('mysql+pymysql://%s:%s@%s:%s/%s' % (
-        DB_RW_USER, DB_RW_PWD, DB_RW_HOST, DB_PORT, DB_NAME))
-
-if not DB_DDL_URI:
-    DB_DDL_URI = ('mysql+pymysql://%s:%s@%s:%s/%s' % (
-        DB_DDL_USER, DB_DDL_PWD, DB_RW_HOST, DB_PORT, DB_NAME))
-
-GEOIP_PATH = os.environ.get('GEOIP_PATH')
-
-REDIS_HOST = os.environ.get('REDIS_HOST')
-REDIS_PORT = os.environ.get('REDIS_PORT', '6379')
-REDIS_DB = '1' if TESTING else '0'
-REDIS_URI = os.environ.get('REDIS_URI')
-if REDIS_HOST and not REDIS_URI:
-    REDIS_URI = 'redis://%s:%s/%s' % (REDIS_HOST, REDIS_PORT, REDIS_DB)
+
+def _db_uri(kind, host_kind):
+    environ = os.environ
+    uri = environ.get('DB_%s_URI' % kind)
+    if uri:
+        return uri
+    host = environ.get('DB_%s_HOST' % host_kind, environ.get('DB_HOST'))
+    user = environ.get('DB_%s_USER' % kind, environ.get('DB_USER', 'location'))
+    pwd = environ.get('DB_%s_PWD' % kind, environ.get('DB_PWD', 'location'))
+    port = environ.get('DB_PORT', '3306')
+    name = environ.get('DB_NAME', 'location')
+    return 'mysql+pymysql://%s:%s@%s:%s/%s' % (user, pwd, host, port, name)
+
+
+def db_ro_uri():
+    """
+    Return the read-only database connection string, based on the
+    current environment variables.
+    """
+    return _db_uri('RO', 'RO')
+
+
+def db_rw_uri():
+    """
+    Return the read-write database connection string, based on the
+    current environment variables.
+    """
+    return _db_uri('RW', 'RW')
+
+
+def db_ddl_uri():
+    """
+    Return the database connection string used for schema changes,
+    based on the current environment variables.
+    """
+    return _db_uri('DDL', 'RW')
+
+
+def geoip_path():
+    """Return the GeoIP database path from the environment."""
+    return os.environ.get('GEOIP_PATH')
+
+
+def redis_uri():
+    """
+    Return the Redis connection string, based on the current
+    environment variables.
+    """
+    uri = os.environ.get('REDIS_URI')
+    host = os.environ.get('REDIS_HOST')
+    if host and not uri:
+        port = os.environ.get('REDIS_PORT', '6379')
+        uri = 'redis://%s:%s/%s' % (host, port, '1' if TESTING else '0')
+    return uri
+
+
+DB_RO_URI = db_ro_uri()
+DB_RW_URI = db_rw_uri()
+DB_DDL_URI = db_ddl_uri()
+GEOIP_PATH = geoip_path()
+REDIS_URI = redis_uri()
 
 if os.path.isfile(VERSION_FILE):
     with open(VERSION_FILE, 'r') as fd:
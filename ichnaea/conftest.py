@@ -10,6 +10,7 @@ from sqlalchemy import (
     event,
     inspect,
     text,
+    UniqueConstraint,
 )
 import webtest
 
@@ -134,31 +135,52 @@ def package():
             print(obj)
 
 
+def setup_api_keys(conn):
+    # always add a test API key
+    conn.execute(ApiKey.__table__.delete())
+    # insert both keys in one executemany call, which requires
+    # the same columns to be present in each row
+    conn.execute(ApiKey.__table__.insert(), [
+        dict(valid_key='test',
+             allow_fallback=False, allow_locate=True, allow_transfer=True,
+             fallback_name='fall',
+             fallback_url='http://127.0.0.1:9/?api',
+             fallback_ratelimit=10,
+             fallback_ratelimit_interval=60,
+             fallback_cache_expire=60),
+        dict(valid_key='export',
+             allow_fallback=False, allow_locate=False, allow_transfer=False,
+             fallback_name=None,
+             fallback_url=None,
+             fallback_ratelimit=None,
+             fallback_ratelimit_interval=None,
+             fallback_cache_expire=None),
+    ])
+
+
 def setup_tables(engine):
     with engine.connect() as conn:
         trans = conn.begin()
         _Model.metadata.create_all(engine)
         # Now stamp the latest alembic version
         command.stamp(ALEMBIC_CFG, 'head')
+        setup_api_keys(conn)
+        trans.commit()
 
-        # always add a test API key
-        conn.execute(ApiKey.__table__.delete())
-
-        key1 = ApiKey.__table__.insert().values(
-            valid_key='test',
-            allow_fallback=False, allow_locate=True, allow_transfer=True,
-            fallback_name='fall',
-            fallback_url='http://127.0.0.1:9/?api',
-            fallback_ratelimit=10,
-            fallback_ratelimit_interval=60,
-            fallback_cache_expire=60,
-        )
-        conn.execute(key1)
-        key2 = ApiKey.__table__.insert().values(
-            valid_key='export',
-            allow_fallback=False, allow_locate=False, allow_transfer=False)
-        conn.execute(key2)
 
+def restore_tables(engine):
+    # The schema is set up once per test session, only recreate
+    # the tables a test has dropped.
+    existing = set(inspect(engine).get_table_names())
+    missing = [table for name, table in _Model.metadata.tables.items()
+               if name not in existing]
+    if not missing:
+        return
+    with engine.connect() as conn:
+        trans = conn.begin()
+        _Model.metadata.create_all(conn, tables=missing)
+        if ApiKey.__table__ in missing:
+            setup_api_keys(conn)
         trans.commit()
 
 
@@ -175,10 +197,61 @@ def cleanup_tables(engine):
         trans.commit()
 
 
+def _table_schema(columns, indexes):
+    return (
+        set(columns),
+        set((name, tuple(cols), bool(unique))
+            for name, cols, unique in indexes),
+    )
+
+
+def table_matches(inspector, table):
+    # Compare the reflected columns and indexes of a table with
+    # the model definition.
+    reflected = _table_schema(
+        [col['name'] for col in inspector.get_columns(table.name)],
+        [(idx['name'], idx['column_names'], idx['unique'])
+         for idx in inspector.get_indexes(table.name)])
+    indexes = [(idx.name, [col.name for col in idx.columns], idx.unique)
+               for idx in table.indexes]
+    indexes.extend([(cons.name, [col.name for col in cons.columns], True)
+                    for cons in table.constraints
+                    if isinstance(cons, UniqueConstraint)])
+    expected = _table_schema(table.columns.keys(), indexes)
+    return reflected == expected
+
+
+def truncate_tables(engine):
+    # Empty the tables known to our models, which is much cheaper than
+    # dropping and recreating them. Drop all other tables, for example
+    # those left behind by an older code version, and all tables whose
+    # schema differs from the models, so setup_tables recreates them.
+    # The alembic version table is kept as is.
+    known = _Model.metadata.tables
+    inspector = inspect(engine)
+    with engine.connect() as conn:
+        trans = conn.begin()
+        names = inspector.get_table_names()
+        conn.execute(text('SET FOREIGN_KEY_CHECKS = 0'))
+        stale = []
+        for name in names:
+            if name == 'alembic_version':
+                continue
+            if name in known and table_matches(inspector, known[name]):
+                conn.execute(text('TRUNCATE TABLE `%s`' % name))
+            else:
+                stale.append(name)
+        if stale:
+            tables = '`' + '`, `'.join(stale) + '`'
+            conn.execute(text('DROP TABLE %s' % tables))
+        conn.execute(text('SET FOREIGN_KEY_CHECKS = 1'))
+        trans.commit()
+
+
 def setup_database():
     db = configure_rw_db()
     engine = db.engine
-    cleanup_tables(engine)
+    truncate_tables(engine)
     setup_tables(engine)
     db.close()
 
@@ -192,24 +265,37 @@ def database():
     setup_database()
 
 
+def track_db_calls(conn, cursor, statement, parameters,
+                   context, executemany):
+    # Record statements only for connections with active tracking,
+    # see the `*_session_tracker` fixtures.
+    calls = conn.info.get('calls')
+    if calls is not None:
+        calls.append((statement, parameters))
+
+
 @pytest.yield_fixture(scope='session')
 def db_rw(database):
     db = configure_rw_db()
+    event.listen(db.engine, 'before_cursor_execute', track_db_calls)
     yield db
+    event.remove(db.engine, 'before_cursor_execute', track_db_calls)
     db.close()
 
 
 @pytest.yield_fixture(scope='session')
 def db_ro(database):
     db = configure_ro_db()
+    event.listen(db.engine, 'before_cursor_execute', track_db_calls)
     yield db
+    event.remove(db.engine, 'before_cursor_execute', track_db_calls)
     db.close()
 
 
 @pytest.yield_fixture(scope='function')
 def db_rw_drop_table(db_rw):
     yield db_rw
-    setup_tables(db_rw.engine)
+    restore_tables(db_rw.engine)
 
 
 @pytest.yield_fixture(scope='function')
@@ -247,8 +333,8 @@ def ro_session(db_ro):
 @pytest.yield_fixture(scope='function')
 def rw_session_tracker(rw_session):
     """
-    This install an event handler into the active session, which
-    tracks all SQL statements that are send via the session.
+    This enables tracking of all SQL statements that are send via
+    the active session's connection.
 
     The yielded checker can be called with an integer argument,
     representing the number of expected SQL statements, for example::
@@ -257,33 +343,23 @@ def rw_session_tracker(rw_session):
 
     would only succeed if no SQL statements where made.
     """
-
-    db_events = []
-
-    def scoped_conn_event_handler(calls):
-        def conn_event_handler(**kw):  # pragma: no cover
-            calls.append((kw['statement'], kw['parameters']))
-        return conn_event_handler
-
-    handler = scoped_conn_event_handler(db_events)
-    event.listen(rw_session.bind,
-                 'before_cursor_execute',
-                 handler, named=True)
+    info = rw_session.bind.info
+    info['calls'] = db_calls = []
 
     def checker(num=None):
         if num is not None:
-            assert len(db_events) == num
+            assert len(db_calls) == num
 
     yield checker
 
-    event.remove(rw_session.bind, 'before_cursor_execute', handler)
+    info.pop('calls', None)
 
 
 @pytest.yield_fixture(scope='function')
 def ro_session_tracker(ro_session):
     """
-    This install an event handler into the active session, which
-    tracks all SQL statements that are send via the session.
+    This enables tracking of all SQL statements that are send via
+    the active session's connection.
 
     The yielded checker can be called with an integer argument,
     representing the number of expected SQL statements, for example::
@@ -292,26 +368,16 @@ def ro_session_tracker(ro_session):
 
     would only succeed if no SQL statements where made.
     """
-
-    db_events = []
-
-    def scoped_conn_event_handler(calls):
-        def conn_event_handler(**kw):
-            calls.append((kw['statement'], kw['parameters']))
-        return conn_event_handler
-
-    handler = scoped_conn_event_handler(db_events)
-    event.listen(ro_session.bind,
-                 'before_cursor_execute',
-                 handler, named=True)
+    info = ro_session.bind.info
+    info['calls'] = db_calls = []
 
     def checker(num=None):
         if num is not None:
-            assert len(db_events) == num
+            assert len(db_calls) == num
 
     yield checker
 
-    event.remove(ro_session.bind, 'before_cursor_execute', handler)
+    info.pop('calls', None)
 
 
 @pytest.yield_fixture(scope='function')
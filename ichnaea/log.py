@@ -1,7 +1,11 @@
 """Functionality related to statsd, sentry and freeform logging."""
-from collections import deque
+from collections import (
+    defaultdict,
+    deque,
+)
 import logging
 from random import random
+import re
 import time
 
 from pyramid.httpexceptions import (
@@ -26,6 +30,18 @@ LOGGER = logging.getLogger('ichnaea')
 RAVEN_CLIENT = None  #: The globally configured raven client.
 STATS_CLIENT = None  #: The globally configured statsd client.
 
+# Parses a statsd packet into name, value, type suffix and tags.
+STATS_MESSAGE = re.compile(
+    r'^([^:]+):([^|]+)\|(\w+)(?:\|@[\d.]+)?(?:\|#(.*))?$')
+STATS_TYPES = {
+    'c': 'counter',
+    'g': 'gauge',
+    'h': 'histogram',
+    'm': 'meter',
+    'ms': 'timer',
+    's': 'set',
+}
+
 RAVEN_TRANSPORTS = {
     'gevent': GeventedHTTPTransport,
     'sync': HTTPTransport,
@@ -293,50 +309,40 @@ class DebugStatsClient(StatsClient):
             use_ms=use_ms,
             tag_support=tag_support)
         self.msgs = deque(maxlen=100)
+        self._index = None
 
     def _clear(self):
         self.msgs.clear()
+        self._index = None
 
     def _send_to_server(self, packet):
         self.msgs.append(packet)
-
-    def _find_messages(self, msg_type, msg_name, msg_value=None, msg_tags=()):
-        data = {
-            'counter': [],
-            'timer': [],
-            'gauge': [],
-            'histogram': [],
-            'meter': [],
-            'set': [],
-        }
-        for msg in self.msgs:
-            tags = ()
-            if '|#' in msg:
-                parts = msg.split('|#')
-                tags = parts[-1].split(',')
-                msg = parts[0]
-            suffix = msg.split('|')[-1]
-            name, value = msg.split('|')[0].split(':')
-            value = int(value)
-            if suffix == 'g':
-                data['gauge'].append((name, value, tags))
-            elif suffix == 'ms':
-                data['timer'].append((name, value, tags))
-            elif suffix.startswith('c'):
-                data['counter'].append((name, value, tags))
-            elif suffix == 'h':
-                data['histogram'].append((name, value, tags))
-            elif suffix == 'm':  # pragma: no cover
-                data['meter'].append((name, value, tags))
-            elif suffix == 's':
-                data['set'].append((name, value, tags))
-
+        self._index = None
+
+    def _parse_messages(self):
+        # Parse all messages once and index them by type and name,
+        # the index is reset whenever a new message is sent.
+        if self._index is None:
+            index = defaultdict(list)
+            for msg in self.msgs:
+                match = STATS_MESSAGE.match(msg)
+                if match is None:  # pragma: no cover
+                    continue
+                name, value, suffix, tags = match.groups()
+                msg_type = STATS_TYPES.get(suffix)
+                if msg_type is not None:
+                    tags = tags.split(',') if tags else ()
+                    index[(msg_type, name)].append((name, float(value), tags))
+            self._index = index
+        return self._index
+
+    @staticmethod
+    def _filter_messages(msgs, msg_value=None, msg_tags=()):
         result = []
-        for msg in data.get(msg_type):
-            if msg[0] == msg_name:
-                if msg_value is None or msg[1] == msg_value:
-                    if not msg_tags or msg[2] == msg_tags:
-                        result.append((msg[0], msg[1], msg[2]))
+        for msg in msgs:
+            if msg_value is None or msg[1] == msg_value:
+                if not msg_tags or msg[2] == msg_tags:
+                    result.append(msg)
         return result
 
     def check(self, total=None, **kw):
@@ -347,6 +353,7 @@ class DebugStatsClient(StatsClient):
         if total is not None:
             assert total == len(self.msgs)
 
+        index = self._parse_messages()
         for (msg_type, preds) in kw.items():
             for pred in preds:
                 match = 1
@@ -373,6 +380,7 @@ class DebugStatsClient(StatsClient):
                 else:  # pragma: no cover
                     raise TypeError('wanted str or tuple, got %s'
                                     % type(pred))
-                msgs = self._find_messages(msg_type, name, value, tags)
+                msgs = self._filter_messages(
+                    index.get((msg_type, name), ()), value, tags)
                 if isinstance(match, int):
                     assert match == len(msgs)
@@ -471,7 +471,7 @@ class CellShard(StationMixin):
     @classmethod
     def export_stmt(cls):
         stmt = '''SELECT
-CONCAT_WS(",",
+CAST(CONCAT_WS(",",
     CASE radio
         WHEN 0 THEN "GSM"
         WHEN 2 THEN "WCDMA"
@@ -500,11 +500,9 @@ CONCAT_WS(",",
     COALESCE(UNIX_TIMESTAMP(`block_first`), ""),
     COALESCE(UNIX_TIMESTAMP(`block_last`), ""),
     COALESCE(`block_count`, "0")
-) AS `export_value`
+) AS BINARY) AS `export_value`
 FROM %s
 ORDER BY `cellid`
-LIMIT :l
-OFFSET :o
 ''' % cls.__tablename__
         return stmt.replace('\n', ' ')
 
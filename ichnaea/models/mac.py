@@ -219,7 +219,7 @@ class MacStationMixin(StationMixin):
     @classmethod
     def export_stmt(cls):
         stmt = '''SELECT
-CONCAT_WS(",",
+CAST(CONCAT_WS(",",
     LOWER(HEX(`mac`)),
     COALESCE(ROUND(`lat`, 7), ""),
     COALESCE(ROUND(`lon`, 7), ""),
@@ -238,10 +238,8 @@ CONCAT_WS(",",
     COALESCE(UNIX_TIMESTAMP(`block_first`), ""),
     COALESCE(UNIX_TIMESTAMP(`block_last`), ""),
     COALESCE(`block_count`, "0")
-) AS `export_value`
+) AS BINARY) AS `export_value`
 FROM %s
 ORDER BY `mac`
-LIMIT :l
-OFFSET :o
 ''' % cls.__tablename__
         return stmt.replace('\n', ' ')
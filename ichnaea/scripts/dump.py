@@ -5,14 +5,19 @@ Script is installed as `location_dump`.
 """
 
 import argparse
+from operator import itemgetter
 import os
 import os.path
+import shutil
 import sys
 
+import billiard
+from pymysql.cursors import SSCursor
+import simplejson
 from sqlalchemy import text
 
 from ichnaea.config import (
-    DB_RW_URI,
+    db_rw_uri,
     read_config,
 )
 from ichnaea.db import (
@@ -24,61 +29,249 @@ from ichnaea.log import (
     configure_logging,
     LOGGER,
 )
-from ichnaea.models import (
-    BlueShard,
-    CellShard,
-    CellShardOCID,
-    WifiShard,
-)
 from ichnaea import util
 
 
 def where_area(lat, lon, radius):
-    # Construct a where clause based on a bounding box around the given
-    # center point.
+    # Construct a where clause and its bind parameters based on a
+    # bounding box around the given center point.
     if lat is None or lon is None or radius is None:
         return None
     max_lat, min_lat, max_lon, min_lon = bbox(lat, lon, radius)
 
-    return '`lat` <= %s and `lat` >= %s and `lon` <= %s and `lon` >= %s' % (
-        round(max_lat, 5), round(min_lat, 5),
-        round(max_lon, 5), round(min_lon, 5))
-
-
-def dump_model(shard_model, session, fd, where=None):
-    fd.write(shard_model.export_header() + '\n')
-    for model in shard_model.shards().values():
-        LOGGER.info('Exporting table: %s', model.__tablename__)
-        stmt = model.export_stmt()
-        if where:
-            stmt = stmt.replace(' ORDER BY ', ' WHERE %s ORDER BY ' % where)
-        stmt = text(stmt)
-        offset = 0
-        limit = 25000
+    clause = ('`lat` <= :max_lat and `lat` >= :min_lat and '
+              '`lon` <= :max_lon and `lon` >= :min_lon')
+    return (clause, {
+        'max_lat': round(max_lat, 5),
+        'min_lat': round(min_lat, 5),
+        'max_lon': round(max_lon, 5),
+        'min_lon': round(min_lon, 5),
+    })
+
+
+# Upper limit of concurrent shard exports, to avoid overwhelming
+# the database server.
+MAX_CONCURRENCY = 4
+
+# Default number of rows fetched from the database at once and
+# the gzip compression level of the export files. The batch size
+# can be overridden by the ICHNAEA_DUMP_BATCH_SIZE variable.
+BATCH_SIZE = 25000
+COMPRESS_LEVEL = 1
+
+# The export lines are formatted by the database and returned as
+# utf-8 encoded bytes in the only column, see `export_stmt`.
+export_value = itemgetter(0)
+
+
+def positive_int(value):
+    # An argparse type, accepting only integers larger than zero.
+    try:
+        number = int(value)
+    except (TypeError, ValueError):
+        number = 0
+    if number < 1:
+        raise argparse.ArgumentTypeError(
+            '%r is not a positive integer' % value)
+    return number
+
+
+def export_model(datatype):
+    # Import the models only when needed, so the argument parsing
+    # doesn't pay for loading them.
+    from ichnaea.models import (
+        BlueShard,
+        CellShard,
+        CellShardOCID,
+        WifiShard,
+    )
+    return {
+        'blue': BlueShard,
+        'cell': CellShard,
+        'ocid': CellShardOCID,
+        'wifi': WifiShard,
+    }[datatype]
+
+
+def dump_table(model, conn, fd, where=None, batch_size=BATCH_SIZE):
+    LOGGER.info('Exporting table: %s', model.__tablename__)
+    stmt = model.export_stmt()
+    params = {}
+    if where:
+        clause, params = where
+        stmt = stmt.replace(' ORDER BY ', ' WHERE %s ORDER BY ' % clause)
+    compiled = text(stmt).bindparams(**params).compile(dialect=conn.dialect)
+
+    # Use an unbuffered PyMySQL cursor directly, so only one batch of
+    # rows is held in memory at any time. SQLAlchemy would otherwise
+    # buffer the entire result on the client.
+    cursor = conn.connection.cursor(SSCursor)
+    result_rows = 0
+    try:
+        cursor.execute(str(compiled), compiled.params)
         while True:
-            rows = session.execute(
-                stmt.bindparams(o=offset, l=limit)).fetchall()
+            rows = cursor.fetchmany(batch_size)
             if rows:
-                buf = '\n'.join([row.export_value for row in rows])
-                if buf:
-                    buf += '\n'
-                fd.write(buf)
-                offset += limit
+                fd.write(b'\n'.join(map(export_value, rows)) + b'\n')
+                result_rows += len(rows)
             else:
                 break
+    finally:
+        cursor.close()
+    return result_rows
+
+
+def read_checkpoint(filename):
+    path = filename + '.ckpt'
+    if not os.path.isfile(path):
+        return None
+    with open(path, 'r') as fd:
+        return simplejson.load(fd)
+
+
+def write_checkpoint(filename, state):
+    # Write to a temporary file first, so a crash never leaves
+    # behind a partial checkpoint.
+    path = filename + '.ckpt'
+    with open(path + '.tmp', 'w') as fd:
+        simplejson.dump(state, fd)
+    os.rename(path + '.tmp', path)
+
+
+def checkpoint_matches(state, datatype, where):
+    # Only resume an export of the same data type and area. The
+    # where tuple is stored as a list in the JSON checkpoint.
+    return (state.get('datatype') == datatype and
+            state.get('where') == (list(where) if where else None))
+
+
+def resume_checkpoint(filename, datatype, where):
+    state = read_checkpoint(filename)
+    if state is not None and not checkpoint_matches(state, datatype, where):
+        raise ValueError(
+            'Checkpoint for %s does not match the export.' % filename)
+    return state
+
+
+def remove_checkpoint(filename):
+    path = filename + '.ckpt'
+    if os.path.isfile(path):
+        os.remove(path)
+
+
+def dump_model(datatype, session, filename, where=None,
+               batch_size=BATCH_SIZE, compresslevel=COMPRESS_LEVEL):
+    # Each shard table is written as its own gzip member. After each
+    # shard the file size is recorded in a checkpoint file, so an
+    # interrupted export can be resumed from the last completed shard.
+    shard_model = export_model(datatype)
+    state = resume_checkpoint(filename, datatype, where)
+    if (state is not None and 'offset' in state and
+            os.path.isfile(filename)):
+        LOGGER.info('Resuming export after shards: %s', state['shards'])
+        with open(filename, 'ab') as fd:
+            fd.truncate(state['offset'])
+    else:
+        with util.gzip_writer(filename, compresslevel=compresslevel) as fd:
+            fd.write(shard_model.export_header() + '\n')
+        state = {
+            'datatype': datatype,
+            'where': where,
+            'offset': os.path.getsize(filename),
+            'shards': [],
+        }
+
+    conn = session.connection()
+    for shard_id, model in sorted(shard_model.shards().items()):
+        if shard_id in state['shards']:
+            continue
+        with util.gzip_writer(filename, compresslevel=compresslevel,
+                              append=True) as fd:
+            dump_table(model, conn, fd, where=where, batch_size=batch_size)
+        state['offset'] = os.path.getsize(filename)
+        state['shards'].append(shard_id)
+        write_checkpoint(filename, state)
+
+    remove_checkpoint(filename)
+
+
+def dump_shard(db_url, filename, datatype, shard_id, where=None,
+               batch_size=BATCH_SIZE, compresslevel=COMPRESS_LEVEL,
+               _db_rw=None, _session=None):
+    # this is executed in a worker process
+    model = export_model(datatype).shards()[shard_id]
+    db = configure_rw_db(db_url, _db=_db_rw)
+
+    with util.gzip_writer(filename, compresslevel=compresslevel) as fd:
+        with db.engine.connect() as conn:
+            if _session is not None:
+                # testing hook
+                conn = _session.connection()
+            result_rows = dump_table(
+                model, conn, fd, where=where, batch_size=batch_size)
+
+    db.close()
+    return result_rows
+
+
+def dump_shards(pool, db_url, datatype, filename, where=None,
+                batch_size=BATCH_SIZE, compresslevel=COMPRESS_LEVEL):
+    shard_model = export_model(datatype)
+    state = resume_checkpoint(filename, datatype, where) or {}
+    done = set(state.get('shards', ()))
+    state = {'datatype': datatype, 'where': where, 'shards': []}
+
+    # Each shard is exported into its own gzip file, kept next to the
+    # export file, so an interrupted export can be resumed. Concatenated
+    # gzip streams are a valid gzip file, so the final file is
+    # assembled by copying the raw bytes in shard order.
+    parts_dir = filename + '.parts'
+    if not os.path.isdir(parts_dir):
+        os.mkdir(parts_dir)
+
+    header = os.path.join(parts_dir, 'header.csv.gz')
+    with util.gzip_writer(header, compresslevel=compresslevel) as fd:
+        fd.write(shard_model.export_header() + '\n')
+
+    jobs = []
+    filenames = [header]
+    for shard_id in sorted(shard_model.shards().keys()):
+        shard_filename = os.path.join(parts_dir, 'shard_%s.csv.gz' % shard_id)
+        filenames.append(shard_filename)
+        if shard_id in done and os.path.isfile(shard_filename):
+            state['shards'].append(shard_id)
+            continue
+        jobs.append((shard_id, pool.apply_async(
+            dump_shard,
+            (db_url, shard_filename, datatype, shard_id, where,
+             batch_size, compresslevel))))
+
+    for shard_id, job in jobs:
+        job.get()
+        state['shards'].append(shard_id)
+        write_checkpoint(filename, state)
+
+    with open(filename, 'wb') as out_fd:
+        for name in filenames:
+            with open(name, 'rb') as in_fd:
+                shutil.copyfileobj(in_fd, out_fd)
+
+    shutil.rmtree(parts_dir)
+    remove_checkpoint(filename)
 
 
 def dump_file(datatype, session, filename,
-              lat=None, lon=None, radius=None):
-    MODEL = {
-        'blue': BlueShard,
-        'cell': CellShard,
-        'ocid': CellShardOCID,
-        'wifi': WifiShard,
-    }
+              lat=None, lon=None, radius=None,
+              pool=None, db_url=None,
+              batch_size=BATCH_SIZE, compresslevel=COMPRESS_LEVEL):
     where = where_area(lat, lon, radius)
-    with util.gzip_open(filename, 'w') as fd:
-        dump_model(MODEL[datatype], session, fd, where=where)
+    if pool is not None:
+        dump_shards(pool, db_url, datatype, filename, where=where,
+                    batch_size=batch_size, compresslevel=compresslevel)
+        return 0
+
+    dump_model(datatype, session, filename, where=where,
+               batch_size=batch_size, compresslevel=compresslevel)
     return 0
 
 
@@ -95,22 +288,34 @@ def main(argv, _db_rw=None, _dump_file=dump_file):
                         help='The center longitude of the desired area.')
     parser.add_argument('--radius', default=None,
                         help='The radius of the desired area.')
+    parser.add_argument('--concurrency', type=positive_int, default=None,
+                        help='How many concurrent processes to use?')
+    parser.add_argument('--batch-size', type=positive_int, default=None,
+                        help='How many rows to fetch from the database '
+                             'at once? Defaults to ICHNAEA_DUMP_BATCH_SIZE.')
+    parser.add_argument('--compress-level', type=int,
+                        default=COMPRESS_LEVEL, choices=range(1, 10),
+                        help='The gzip compression level, 1 to 9.')
 
     args = parser.parse_args(argv[1:])
     if not args.filename:  # pragma: no cover
         parser.print_help()
         return 1
 
-    filename = os.path.abspath(os.path.expanduser(args.filename))
-    if os.path.isfile(filename):  # pragma: no cover
-        print('File already exists.')
-        return 1
-
     datatype = args.datatype
     if datatype not in ('blue', 'cell', 'ocid', 'wifi'):  # pragma: no cover
         print('Unknown data type.')
         return 1
 
+    batch_size = args.batch_size
+    if batch_size is None:
+        try:
+            batch_size = positive_int(
+                os.environ.get('ICHNAEA_DUMP_BATCH_SIZE', BATCH_SIZE))
+        except argparse.ArgumentTypeError as exc:
+            print('Invalid ICHNAEA_DUMP_BATCH_SIZE: %s' % exc)
+            return 1
+
     lat, lon, radius = (None, None, None)
     if (args.lat is not None and
             args.lon is not None and args.radius is not None):
@@ -118,6 +323,19 @@ def main(argv, _db_rw=None, _dump_file=dump_file):
         lon = float(args.lon)
         radius = int(args.radius)
 
+    # An existing file is only accepted, if it belongs to an interrupted
+    # export of the same data, which can be resumed.
+    filename = os.path.abspath(os.path.expanduser(args.filename))
+    state = read_checkpoint(filename)
+    if state is not None:
+        if not checkpoint_matches(
+                state, datatype, where_area(lat, lon, radius)):
+            print('Checkpoint does not match the export.')
+            return 1
+    elif os.path.isfile(filename):  # pragma: no cover
+        print('File already exists.')
+        return 1
+
     configure_logging()
 
     if ('ICHNAEA_CFG' not in os.environ and
@@ -126,14 +344,29 @@ def main(argv, _db_rw=None, _dump_file=dump_file):
         return 1
 
     app_config = read_config()
-    if DB_RW_URI:
-        db = configure_rw_db(_db=_db_rw)
-    else:  # pragma: no cover
-        db = configure_rw_db(app_config.get('database', 'rw_url'), _db=_db_rw)
-
-    with db_worker_session(db, commit=False) as session:
-        exit_code = _dump_file(
-            datatype, session, filename, lat=lat, lon=lon, radius=radius)
+    db_url = db_rw_uri()
+    if not db_url:  # pragma: no cover
+        db_url = app_config.get('database', 'rw_url')
+    db = configure_rw_db(db_url, _db=_db_rw)
+
+    concurrency = min(billiard.cpu_count(), MAX_CONCURRENCY)
+    if args.concurrency is not None:
+        concurrency = args.concurrency
+
+    pool = None
+    if concurrency > 1:  # pragma: no cover
+        pool = billiard.Pool(processes=concurrency)
+
+    try:
+        with db_worker_session(db, commit=False) as session:
+            exit_code = _dump_file(
+                datatype, session, filename, lat=lat, lon=lon, radius=radius,
+                pool=pool, db_url=db_url, batch_size=batch_size,
+                compresslevel=args.compress_level)
+    finally:
+        if pool is not None:  # pragma: no cover
+            pool.close()
+            pool.join()
     return exit_code
 
 
@@ -1,6 +1,13 @@
 import os.path
+import subprocess
+import sys
 
+import mock
+import pytest
+
+from ichnaea.config import DB_RW_URI
 from ichnaea.conftest import GB_LAT, GB_LON
+from ichnaea.models import WifiShard
 from ichnaea.scripts import dump
 from ichnaea.tests.factories import (
     BlueShardFactory,
@@ -12,10 +19,31 @@ from ichnaea import util
 
 
 def _dump_nothing(datatype, session, filename,
-                  lat=None, lon=None, radius=None):
+                  lat=None, lon=None, radius=None,
+                  pool=None, db_url=None,
+                  batch_size=None, compresslevel=None):
     return 0
 
 
+class _FakeJob(object):
+
+    def __init__(self, result):
+        self.result = result
+
+    def get(self):
+        return self.result
+
+
+class _FakePool(object):
+    # Runs the jobs synchronously, passing in the testing hooks.
+
+    def __init__(self, **kw):
+        self.kw = kw
+
+    def apply_async(self, func, args):
+        return _FakeJob(func(*args, **self.kw))
+
+
 class TestDump(object):
 
     def test_compiles(self):
@@ -24,16 +52,80 @@ class TestDump(object):
     def test_main(self, db_rw):
         assert dump.main(
             ['script', '--datatype=blue', '--filename=/tmp/foo.tar.gz',
-             '--lat=51.0', '--lon=0.1', '--radius=25000'],
+             '--lat=51.0', '--lon=0.1', '--radius=25000',
+             '--concurrency=1', '--batch-size=100', '--compress-level=9'],
             _db_rw=db_rw, _dump_file=_dump_nothing) == 0
 
+    def test_main_batch_size(self, db_rw):
+        argv = ['script', '--datatype=blue', '--filename=/tmp/foo.tar.gz']
+        for value in ('0', '-1', 'a'):
+            with pytest.raises(SystemExit):
+                dump.main(argv + ['--batch-size=' + value],
+                          _db_rw=db_rw, _dump_file=_dump_nothing)
+
+            with mock.patch.dict(os.environ,
+                                 {'ICHNAEA_DUMP_BATCH_SIZE': value}):
+                assert dump.main(argv, _db_rw=db_rw,
+                                 _dump_file=_dump_nothing) == 1
+
+        dump_file = mock.Mock(return_value=0)
+        with mock.patch.dict(os.environ, {'ICHNAEA_DUMP_BATCH_SIZE': '10'}):
+            assert dump.main(argv + ['--concurrency=1'],
+                             _db_rw=db_rw, _dump_file=dump_file) == 0
+        assert dump_file.call_args[1]['batch_size'] == 10
+
+    def test_main_concurrency(self, db_rw):
+        argv = ['script', '--datatype=blue', '--filename=/tmp/foo.tar.gz']
+        for value in ('0', '-1', 'a'):
+            with pytest.raises(SystemExit):
+                dump.main(argv + ['--concurrency=' + value],
+                          _db_rw=db_rw, _dump_file=_dump_nothing)
+
+    def test_main_pool(self, db_rw):
+        # The pool workers use their own database connections,
+        # so the test data needs to be committed.
+        session = db_rw.session_factory(bind=db_rw.engine)
+        wifis = WifiShardFactory.create_batch(3, session=session)
+        session.commit()
+        try:
+            with util.selfdestruct_tempdir() as temp_dir:
+                path = os.path.join(temp_dir, 'wifi.csv.gz')
+                # Run the script in a new process, as the billiard pool
+                # doesn't work with the gevent monkey patches applied
+                # in the test process.
+                subprocess.check_call([
+                    sys.executable, '-c',
+                    'import sys; from ichnaea.scripts.dump import main; '
+                    'sys.exit(main(sys.argv))',
+                    '--datatype=wifi', '--filename=' + path,
+                    '--concurrency=2', '--batch-size=1'])
+
+                assert not os.path.isfile(path + '.ckpt')
+                assert not os.path.isdir(path + '.parts')
+                with util.gzip_open(path, 'r') as fd:
+                    lines = fd.readlines()
+                assert len(lines) == len(wifis) + 1
+                for wifi in wifis:
+                    assert [True for line in lines
+                            if wifi.mac in line] == [True]
+        finally:
+            for wifi in wifis:
+                session.delete(wifi)
+            session.commit()
+            session.close()
+
     def test_where(self):
         assert dump.where_area(None, None, None) is None
         assert dump.where_area(GB_LAT, None, None) is None
         assert dump.where_area(GB_LAT, GB_LON, None) is None
         assert dump.where_area(GB_LAT, GB_LON, 25000) == (
-            '`lat` <= 51.7247 and `lat` >= 51.27529 and '
-            '`lon` <= 0.26002 and `lon` >= -0.46002')
+            '`lat` <= :max_lat and `lat` >= :min_lat and '
+            '`lon` <= :max_lon and `lon` >= :min_lon', {
+                'max_lat': 51.7247,
+                'min_lat': 51.27529,
+                'max_lon': 0.26002,
+                'min_lon': -0.46002,
+            })
 
     def _export(self, session, datatype, expected_keys, restrict=False):
         with util.selfdestruct_tempdir() as temp_dir:
@@ -51,6 +143,106 @@ class TestDump(object):
                 for key in expected_keys:
                     assert [True for line in lines if key in line] == [True]
 
+    def test_shard(self, session):
+        wifis = WifiShardFactory.create_batch(3)
+        session.flush()
+        shard_id = WifiShard.shard_id(wifis[0].mac)
+        expected = [wifi.mac for wifi in wifis
+                    if WifiShard.shard_id(wifi.mac) == shard_id]
+        with util.selfdestruct_tempdir() as temp_dir:
+            path = os.path.join(temp_dir, 'shard.csv.gz')
+            result = dump.dump_shard(
+                DB_RW_URI, path, 'wifi', shard_id, batch_size=1,
+                _session=session)
+            assert result == len(expected)
+            with util.gzip_open(path, 'r') as fd:
+                lines = fd.readlines()
+            assert len(lines) == len(expected)
+            for key in expected:
+                assert [True for line in lines if key in line] == [True]
+
+    def test_resume(self, session):
+        wifis = WifiShardFactory.create_batch(5)
+        session.flush()
+        skipped = WifiShard.shard_id(wifis[0].mac)
+        expected = [wifi.mac for wifi in wifis
+                    if WifiShard.shard_id(wifi.mac) != skipped]
+        with util.selfdestruct_tempdir() as temp_dir:
+            path = os.path.join(temp_dir, 'wifi.csv.gz')
+            with util.gzip_writer(path) as fd:
+                fd.write(WifiShard.export_header() + '\n')
+            dump.write_checkpoint(path, {
+                'datatype': 'wifi',
+                'where': None,
+                'offset': os.path.getsize(path),
+                'shards': [skipped],
+            })
+
+            dump.dump_file('wifi', session, path)
+            assert not os.path.isfile(path + '.ckpt')
+            with util.gzip_open(path, 'r') as fd:
+                lines = fd.readlines()
+            assert len(lines) == len(expected) + 1
+            for key in expected:
+                assert [True for line in lines if key in line] == [True]
+
+    def test_resume_mismatch(self, db_rw, session):
+        with util.selfdestruct_tempdir() as temp_dir:
+            path = os.path.join(temp_dir, 'wifi.csv.gz')
+            with util.gzip_writer(path) as fd:
+                fd.write(WifiShard.export_header() + '\n')
+            dump.write_checkpoint(path, {
+                'datatype': 'wifi',
+                'where': None,
+                'offset': os.path.getsize(path),
+                'shards': [],
+            })
+
+            with pytest.raises(ValueError):
+                dump.dump_file('blue', session, path)
+            with pytest.raises(ValueError):
+                dump.dump_file('wifi', session, path,
+                               lat=GB_LAT, lon=GB_LON, radius=25000)
+            assert dump.main(
+                ['script', '--datatype=blue', '--filename=' + path],
+                _db_rw=db_rw, _dump_file=_dump_nothing) == 1
+            assert dump.main(
+                ['script', '--datatype=wifi', '--filename=' + path,
+                 '--concurrency=1'],
+                _db_rw=db_rw, _dump_file=_dump_nothing) == 0
+
+    def test_shards(self, session):
+        wifis = WifiShardFactory.create_batch(5)
+        session.flush()
+        skipped = WifiShard.shard_id(wifis[0].mac)
+        expected = [wifi.mac for wifi in wifis
+                    if WifiShard.shard_id(wifi.mac) != skipped]
+        pool = _FakePool(_session=session)
+        with util.selfdestruct_tempdir() as temp_dir:
+            path = os.path.join(temp_dir, 'wifi.csv.gz')
+            parts_dir = path + '.parts'
+            # Resume with an empty export of one of the shards.
+            os.mkdir(parts_dir)
+            with util.gzip_writer(os.path.join(
+                    parts_dir, 'shard_%s.csv.gz' % skipped)) as fd:
+                fd.write(b'')
+            dump.write_checkpoint(path, {
+                'datatype': 'wifi',
+                'where': None,
+                'shards': [skipped],
+            })
+
+            dump.dump_file('wifi', session, path,
+                           pool=pool, db_url=DB_RW_URI)
+            assert not os.path.isfile(path + '.ckpt')
+            assert not os.path.isdir(parts_dir)
+            with util.gzip_open(path, 'r') as fd:
+                lines = fd.readlines()
+            assert lines[0] == WifiShard.export_header() + '\n'
+            assert len(lines) == len(expected) + 1
+            for key in expected:
+                assert [True for line in lines if key in line] == [True]
+
     def _cell_keys(self, cells):
         keys = []
         for cell in cells:
@@ -39,6 +39,14 @@ class TestStatsAPI(object):
             set=['metric'],
             timer=['metric'])
 
+    def test_check_repeated(self, stats):
+        stats.incr('metric', 2)
+        stats.check(counter=[('metric', 1, 2)])
+        stats.incr('metric', 3, tags=['key:value'])
+        stats.check(counter=[('metric', 2), ('metric', 1, ['key:value'])])
+        stats._clear()
+        stats.check(counter=[('metric', 0)])
+
 
 class TestStatsTags(object):
 
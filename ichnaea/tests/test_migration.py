@@ -60,7 +60,9 @@ class TestMigration(object):
     @pytest.yield_fixture(scope='function')
     def db(self, db_rw):
         yield db_rw
-        # setup normal database schema again
+        # setup normal database schema again, the migrated tables
+        # might not match the models, so drop them first
+        cleanup_tables(db_rw.engine)
         setup_database()
 
     def current_db_revision(self, db):
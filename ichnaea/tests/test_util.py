@@ -1,4 +1,6 @@
 from datetime import datetime
+from distutils.spawn import find_executable
+import os.path
 
 import pytest
 from pytz import UTC
@@ -42,6 +44,23 @@ class TestUtil(object):
         assert isinstance(result, bytes)
         assert result == b'\x00ab'
 
+    @pytest.mark.parametrize('pigz', [True, False])
+    def test_gzip_writer(self, pigz):
+        if pigz and find_executable('pigz') is None:
+            pytest.skip('pigz is not installed')
+        writer_type = util._PigzWriter if pigz else util._ThreadWriter
+        with util.selfdestruct_tempdir() as temp_dir:
+            path = os.path.join(temp_dir, 'foo.gz')
+            with util.gzip_writer(path, pigz=pigz) as fd:
+                assert isinstance(fd.writer, writer_type)
+                fd.write(u'foo\n')
+                fd.write(b'bar\n')
+            with util.gzip_writer(path, pigz=pigz, append=True) as fd:
+                assert isinstance(fd.writer, writer_type)
+                fd.write(u'baz\n')
+            with util.gzip_open(path, 'r') as fd:
+                assert fd.read() == u'foo\nbar\nbaz\n'
+
     def test_decode_gzip_error(self):
         with pytest.raises(GZIPDecodeError):
             util.decode_gzip(self.gzip_foo[:1])
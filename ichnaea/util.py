@@ -5,12 +5,15 @@ import gzip
 from io import BytesIO
 import shutil
 import struct
+import subprocess
 import sys
 import tempfile
+import threading
 import zlib
 
 from pytz import UTC
 import six
+from six.moves.queue import Queue
 
 from ichnaea.exceptions import GZIPDecodeError
 
@@ -62,6 +65,107 @@ def gzip_open(filename, mode, compresslevel=6):  # pragma: no cover
                 yield gzip_file
 
 
+class _PigzWriter(object):
+    """Write gzip data by piping it into an external pigz process."""
+
+    def __init__(self, fd, compresslevel):
+        self.process = subprocess.Popen(
+            ['pigz', '-c', '-%s' % compresslevel],
+            stdin=subprocess.PIPE, stdout=fd)
+
+    def write(self, data):
+        self.process.stdin.write(data)
+
+    def close(self):
+        try:
+            self.process.stdin.close()
+        except (IOError, OSError):  # pragma: no cover
+            # A broken pipe, pigz already exited. Report its
+            # exit status below instead.
+            pass
+        if self.process.wait() != 0:  # pragma: no cover
+            raise IOError('pigz exited with %s' % self.process.returncode)
+
+
+class _ThreadWriter(object):
+    """Write gzip data, compressing it in a background thread."""
+
+    def __init__(self, fd, compresslevel):
+        self.error = None
+        self.gzip_file = GzipFile(
+            None, 'wb', compresslevel=compresslevel, fileobj=fd)
+        self.queue = Queue(maxsize=4)
+        self.thread = threading.Thread(target=self._run)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def _run(self):
+        while True:
+            data = self.queue.get()
+            if data is None:
+                break
+            if self.error is None:
+                try:
+                    self.gzip_file.write(data)
+                except Exception as exc:  # pragma: no cover
+                    self.error = exc
+
+    def write(self, data):
+        self.queue.put(data)
+
+    def close(self):
+        self.queue.put(None)
+        self.thread.join()
+        self.gzip_file.close()
+        if self.error is not None:  # pragma: no cover
+            raise self.error
+
+
+class _TextWriter(object):
+
+    def __init__(self, writer, encoding='utf-8'):
+        self.writer = writer
+        self.encoding = encoding
+
+    def write(self, data):
+        if isinstance(data, six.text_type):
+            data = data.encode(self.encoding)
+        self.writer.write(data)
+
+
+@contextmanager
+def gzip_writer(filename, compresslevel=1, pigz=True, append=False,
+                buffer_size=1 << 20):
+    """
+    Open a gzip file for writing, doing the compression outside
+    of the calling thread.
+
+    If available, the data is piped into an external `pigz` process,
+    otherwise it is compressed in a background thread. Text data is
+    encoded as utf-8.
+
+    :param append: Append a new gzip member to an existing file.
+    :param buffer_size: The buffer size of the underlying binary file,
+                        used to collect the compressed output of the
+                        background thread. It has no effect if `pigz`
+                        is used, which writes to the file directly.
+    """
+    mode = 'ab' if append else 'wb'
+    with open(filename, mode, buffer_size) as fd:
+        writer = None
+        if pigz:
+            try:
+                writer = _PigzWriter(fd, compresslevel)
+            except OSError:  # pragma: no cover
+                pass
+        if writer is None:
+            writer = _ThreadWriter(fd, compresslevel)
+        try:
+            yield _TextWriter(writer)
+        finally:
+            writer.close()
+
+
 def encode_gzip(data, compresslevel=6, encoding='utf-8'):
     """Encode the passed in data with gzip."""
     if encoding and isinstance(data, six.string_types):
@@ -12,9 +12,9 @@ from ichnaea.api.locate.searcher import (
 )
 from ichnaea.cache import configure_redis
 from ichnaea.config import (
-    DB_RO_URI,
-    GEOIP_PATH,
-    REDIS_URI,
+    db_ro_uri,
+    geoip_path,
+    redis_uri,
 )
 from ichnaea.content.views import configure_content
 from ichnaea.db import (
@@ -78,8 +78,9 @@ def main(app_config, ping_connections=False,
     # configure outside connections
     registry = config.registry
 
-    if DB_RO_URI:
-        registry.db_ro = configure_ro_db(_db=_db_ro)
+    ro_uri = db_ro_uri()
+    if ro_uri:
+        registry.db_ro = configure_ro_db(ro_uri, _db=_db_ro)
     else:  # pragma: no cover
         registry.db_ro = configure_ro_db(
             app_config.get('database', 'ro_url'), _db=_db_ro)
@@ -87,9 +88,10 @@ def main(app_config, ping_connections=False,
     registry.raven_client = raven_client = configure_raven(
         app_config, transport='gevent', _client=_raven_client)
 
-    if REDIS_URI:
+    cache_url = redis_uri()
+    if cache_url:
         registry.redis_client = redis_client = configure_redis(
-            _client=_redis_client)
+            cache_url, _client=_redis_client)
     else:  # pragma: no cover
         registry.redis_client = redis_client = configure_redis(
             app_config.get('cache', 'cache_url'), _client=_redis_client)
@@ -99,9 +101,10 @@ def main(app_config, ping_connections=False,
 
     registry.http_session = configure_http_session(_session=_http_session)
 
-    if GEOIP_PATH:
+    geoip_file = geoip_path()
+    if geoip_file:
         registry.geoip_db = geoip_db = configure_geoip(
-            raven_client=raven_client, _client=_geoip_db)
+            geoip_file, raven_client=raven_client, _client=_geoip_db)
     else:  # pragma: no cover
         registry.geoip_db = geoip_db = configure_geoip(
             app_config.get('geoip', 'db_path'), raven_client=raven_client,
@@ -121,9 +124,13 @@ def main(app_config, ping_connections=False,
                                 ('region_searcher',
                                  configure_region_searcher,
                                  _region_searcher)):
+        if default is not None:
+            # test-only hook, use the pre-configured searcher as is
+            setattr(registry, name, default)
+            continue
         searcher = func(geoip_db=geoip_db, raven_client=raven_client,
                         redis_client=redis_client, stats_client=stats_client,
-                        data_queues=data_queues, _searcher=default)
+                        data_queues=data_queues)
         setattr(registry, name, searcher)
 
     config.add_tween('ichnaea.db.db_tween_factory', under=EXCVIEW)